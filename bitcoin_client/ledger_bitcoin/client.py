@@ -9,7 +9,6 @@ from .client_command import ClientCommandInterpreter
 from .client_base import Client, TransportClient
 from .client_legacy import LegacyClient
 from .exception import DeviceException
-from .merkle import get_merkleized_map_commitment
 from .wallet import WalletPolicy, WalletType
 from .psbt import PSBT, normalize_psbt
 from ._serialize import deser_string
@@ -162,18 +161,15 @@ class NewClient(Client):
         input_maps: List[Mapping[bytes, bytes]] = []
         for _ in range(len(psbt_v2.inputs)):
             input_maps.append(parse_stream_to_map(f))
-        for m in input_maps:
-            client_intepreter.add_known_mapping(m)
 
         output_maps: List[Mapping[bytes, bytes]] = []
         for _ in range(len(psbt_v2.outputs)):
             output_maps.append(parse_stream_to_map(f))
-        for m in output_maps:
-            client_intepreter.add_known_mapping(m)
 
-        # We also add the Merkle tree of the input (resp. output) map commitments as a known tree
-        input_commitments = [get_merkleized_map_commitment(m_in) for m_in in input_maps]
-        output_commitments = [get_merkleized_map_commitment(m_out) for m_out in output_maps]
+        # We also add the Merkle tree of the input (resp. output) map commitments as a known tree;
+        # add_known_mapping returns each map's commitment, so the maps are only hashed once
+        input_commitments = [client_intepreter.add_known_mapping(m_in) for m_in in input_maps]
+        output_commitments = [client_intepreter.add_known_mapping(m_out) for m_out in output_maps]
 
         client_intepreter.add_known_list(input_commitments)
         client_intepreter.add_known_list(output_commitments)
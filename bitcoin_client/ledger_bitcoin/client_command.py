@@ -1,7 +1,8 @@
 from enum import IntEnum
-from typing import List, Mapping
-from collections import deque
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+from collections import OrderedDict
 from hashlib import sha256
+from itertools import islice
 
 from .common import ByteStreamParser, sha256, write_varint
 from .merkle import MerkleTree, element_hash
@@ -15,6 +16,53 @@ class ClientCommandCode(IntEnum):
     GET_MORE_ELEMENTS = 0xA0
 
 
+class ElementQueue:
+    """A FIFO queue of byte elements that all have the same length.
+
+    It holds the response elements that could not fit in a single message, to be
+    returned by successive GET_MORE_ELEMENTS commands. The uniform element length
+    is enforced when elements are enqueued, so that consumers do not need to
+    re-validate the entire queue on every command.
+
+    The elements are packed back to back in a single bytearray with a head
+    offset, rather than stored as individual bytes objects, so that consumers
+    can copy out a batch of elements with a single slice.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.head = 0
+        self.element_len: Optional[int] = None
+
+    def __len__(self) -> int:
+        """Return the number of queued elements."""
+        if self.element_len is None:
+            return 0
+        return (len(self.buf) - self.head) // self.element_len
+
+    def extend(self, new_elements: Iterable[bytes]) -> None:
+        for el in new_elements:
+            if self.element_len is None:
+                self.element_len = len(el)
+            elif len(el) != self.element_len:
+                raise ValueError(
+                    "The queue must only contain elements of the same byte length."
+                )
+            self.buf += el
+
+    def pop_elements(self, n: int) -> bytes:
+        """Remove the first `n` elements and return them as a single bytes object."""
+        end = self.head + n * self.element_len
+        result = bytes(self.buf[self.head:end])
+        self.head = end
+        if self.head == len(self.buf):
+            # fully drained; the next batch of elements may have a different length
+            self.buf.clear()
+            self.head = 0
+            self.element_len = None
+        return result
+
+
 class ClientCommand:
     def execute(self, request: bytes) -> bytes:
         raise NotImplementedError("Subclasses should implement this method.")
@@ -38,75 +86,96 @@ class YieldCommand(ClientCommand):
 
 
 class GetPreimageCommand(ClientCommand):
-    def __init__(self, known_preimages: Mapping[bytes, bytes], queue: "deque[bytes]"):
+    def __init__(self, known_preimages: Dict[int, Tuple[bytes, bytes]], queue: ElementQueue):
         self.queue = queue
         self.known_preimages = known_preimages
+        # bound method, to skip the attribute-lookup chain on every command
+        self._get_preimage = known_preimages.get
 
     @property
     def code(self) -> int:
         return ClientCommandCode.GET_PREIMAGE
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        # fixed layout: 1 byte command code, 1 byte 0x00, 32 bytes hash
+        if len(request) != 34:
+            raise ValueError("Wrong request length.")
 
-        if req.read_bytes(1) != b'\0':
+        if request[1] != 0:
             raise RuntimeError(f"Unsupported request: the first byte should be 0")
 
-        req_hash = req.read_bytes(32)
-        req.assert_empty()
+        req_hash = request[2:34]
 
-        if req_hash in self.known_preimages:
-            known_preimage = self.known_preimages[req_hash]
+        entry = self._get_preimage(int.from_bytes(req_hash[:8], byteorder="big"))
 
-            preimage_len_out = write_varint(len(known_preimage))
+        # the prefix key is only a fast probe; verify the full hash before answering
+        if entry is None or entry[0] != req_hash:
+            raise RuntimeError(f"Requested unknown preimage for: {req_hash.hex()}")
 
-            # We can send at most 255 - len(preimage_len_out) - 1 bytes in a single message;
-            # the rest will be stored for GET_MORE_ELEMENTS
+        known_preimage = entry[1]
 
-            max_payload_size = 255 - len(preimage_len_out) - 1
+        preimage_len_out = write_varint(len(known_preimage))
 
-            payload_size = min(max_payload_size, len(known_preimage))
+        # We can send at most 255 - len(preimage_len_out) - 1 bytes in a single message;
+        # the rest will be stored for GET_MORE_ELEMENTS
 
-            if payload_size < len(known_preimage):
-                # split into list of length-1 bytes elements
-                extra_elements = [
-                    known_preimage[i: i + 1]
-                    for i in range(payload_size, len(known_preimage))
-                ]
-                # add to the queue any remaining extra bytes
-                self.queue.extend(extra_elements)
+        max_payload_size = 255 - len(preimage_len_out) - 1
 
-            return (
-                preimage_len_out
-                + payload_size.to_bytes(1, byteorder="big")
-                + known_preimage[:payload_size]
-            )
+        payload_size = min(max_payload_size, len(known_preimage))
 
-        # not found
-        raise RuntimeError(f"Requested unknown preimage for: {req_hash.hex()}")
+        if payload_size < len(known_preimage):
+            # split into list of length-1 bytes elements
+            extra_elements = [
+                known_preimage[i: i + 1]
+                for i in range(payload_size, len(known_preimage))
+            ]
+            # add to the queue any remaining extra bytes
+            self.queue.extend(extra_elements)
+
+        return b"".join(
+            (
+                preimage_len_out,
+                bytes((payload_size,)),
+                known_preimage[:payload_size],
+            )
+        )
 
 
 class GetMerkleLeafProofCommand(ClientCommand):
-    def __init__(self, known_trees: Mapping[bytes, MerkleTree], queue: "deque[bytes]"):
+    # maximum number of (leaf value, proof) pairs kept in the LRU cache
+    PROOF_CACHE_SIZE = 256
+
+    def __init__(self, known_trees: Dict[bytes, MerkleTree], queue: ElementQueue):
         self.queue = queue
         self.known_trees = known_trees
+        # bound method, to skip the attribute-lookup chain on every command
+        self._get_tree = known_trees.get
+
+        # LRU cache of (leaf value, proof) pairs keyed by (root, leaf_index); the
+        # hardware wallet often re-requests the same proof during an execution
+        self._proof_cache: "OrderedDict[Tuple[bytes, int], Tuple[bytes, List[bytes]]]" = OrderedDict()
 
     @property
     def code(self) -> int:
         return ClientCommandCode.GET_MERKLE_LEAF_PROOF
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        # layout: 1 byte command code, 32 bytes root, then two varints; only the
+        # variable-length tail needs a parser
+        if len(request) < 35:
+            raise ValueError("Wrong request length.")
 
-        root = req.read_bytes(32)
+        root = request[1:33]
+
+        req = ByteStreamParser(request[33:])
         tree_size = req.read_varint()
         leaf_index = req.read_varint()
         req.assert_empty()
 
-        if not root in self.known_trees:
-            raise ValueError(f"Unknown Merkle root: {root.hex()}.")
+        mt: Optional[MerkleTree] = self._get_tree(root)
 
-        mt: MerkleTree = self.known_trees[root]
+        if mt is None:
+            raise ValueError(f"Unknown Merkle root: {root.hex()}.")
 
         if leaf_index >= tree_size or len(mt) != tree_size:
             raise ValueError(f"Invalid index or tree size.")
@@ -116,7 +185,17 @@ class GetMerkleLeafProofCommand(ClientCommand):
                 "This command should not execute when the queue is not empty."
             )
 
-        proof = mt.prove_leaf(leaf_index)
+        cache_key = (root, leaf_index)
+        cached = self._proof_cache.get(cache_key)
+        if cached is None:
+            cached = (mt.get(leaf_index), mt.prove_leaf(leaf_index))
+            self._proof_cache[cache_key] = cached
+            if len(self._proof_cache) > self.PROOF_CACHE_SIZE:
+                self._proof_cache.popitem(last=False)
+        else:
+            self._proof_cache.move_to_end(cache_key)
+
+        leaf_value, proof = cached
 
         # Compute how many elements we can fit in 255 - 32 - 1 - 1 = 221 bytes
         n_response_elements = min((255 - 32 - 1 - 1) // 32, len(proof))
@@ -124,48 +203,50 @@ class GetMerkleLeafProofCommand(ClientCommand):
 
         # Add to the queue any proof elements that do not fit the response
         if (n_leftover_elements > 0):
-            self.queue.extend(proof[-n_leftover_elements:])
+            self.queue.extend(islice(proof, n_response_elements, None))
 
         return b"".join(
-            [
-                mt.get(leaf_index),
-                len(proof).to_bytes(1, byteorder="big"),
-                n_response_elements.to_bytes(1, byteorder="big"),
-                *proof[:n_response_elements],
-            ]
+            (
+                leaf_value,
+                bytes((len(proof), n_response_elements)),
+                *islice(proof, n_response_elements),
+            )
         )
 
 
 class GetMerkleLeafIndexCommand(ClientCommand):
-    def __init__(self, known_trees: Mapping[bytes, MerkleTree]):
-        self.known_trees = known_trees
+    def __init__(self, known_leaf_indexes: Dict[bytes, Dict[bytes, int]]):
+        self.known_leaf_indexes = known_leaf_indexes
+        # bound method, to skip the attribute-lookup chain on every command
+        self._get_leaf_indexes = known_leaf_indexes.get
 
     @property
     def code(self) -> int:
         return ClientCommandCode.GET_MERKLE_LEAF_INDEX
 
     def execute(self, request: bytes) -> bytes:
-        req = ByteStreamParser(request[1:])
+        # fixed layout: 1 byte command code, 32 bytes root, 32 bytes leaf hash
+        if len(request) != 65:
+            raise ValueError("Wrong request length.")
 
-        root = req.read_bytes(32)
-        leaf_hash = req.read_bytes(32)
-        req.assert_empty()
+        root = request[1:33]
+        leaf_hash = request[33:65]
+
+        leaf_indexes = self._get_leaf_indexes(root)
 
-        if root not in self.known_trees:
+        if leaf_indexes is None:
             raise ValueError(f"Unknown Merkle root: {root.hex()}.")
 
-        try:
-            leaf_index = self.known_trees[root].leaf_index(leaf_hash)
-            found = 1
-        except ValueError:
-            leaf_index = 0
-            found = 0
+        leaf_index = leaf_indexes.get(leaf_hash)
+
+        if leaf_index is None:
+            return b'\x00' + write_varint(0)
 
-        return found.to_bytes(1, byteorder="big") + write_varint(leaf_index)
+        return b'\x01' + write_varint(leaf_index)
 
 
 class GetMoreElementsCommand(ClientCommand):
-    def __init__(self, queue: "deque[bytes]"):
+    def __init__(self, queue: ElementQueue):
         self.queue = queue
 
     @property
@@ -179,28 +260,14 @@ class GetMoreElementsCommand(ClientCommand):
         if len(self.queue) == 0:
             raise ValueError("No elements to get.")
 
-        element_len = len(self.queue[0])
-        if any(len(el) != element_len for el in self.queue):
-            raise ValueError(
-                "The queue contains elements of different byte length, which is not expected."
-            )
+        # the queue enforces that all its elements have this length
+        element_len = self.queue.element_len
 
         # pop from the queue, keeping the total response length at most 255
 
-        response_elements = bytearray()
-
-        n_added_elements = 0
-        while len(self.queue) > 0 and len(response_elements) + element_len <= 253:
-            response_elements.extend(self.queue.popleft())
-            n_added_elements += 1
+        n_added_elements = min(len(self.queue), 253 // element_len)
 
-        return b"".join(
-            [
-                n_added_elements.to_bytes(1, byteorder="big"),
-                element_len.to_bytes(1, byteorder="big"),
-                bytes(response_elements),
-            ]
-        )
+        return bytes((n_added_elements, element_len)) + self.queue.pop_elements(n_added_elements)
 
 
 class ClientCommandInterpreter:
@@ -228,22 +295,31 @@ class ClientCommandInterpreter:
     """
 
     def __init__(self):
-        self.known_preimages: Mapping[bytes, bytes] = {}
-        self.known_trees: Mapping[bytes, MerkleTree] = {}
+        # keyed by the first 8 bytes of the hash (as an int) for cheaper dict
+        # probes; values are (full hash, preimage) pairs so that lookups can
+        # verify the full hash
+        self.known_preimages: Dict[int, Tuple[bytes, bytes]] = {}
+        self.known_trees: Dict[bytes, MerkleTree] = {}
+        self.known_leaf_indexes: Dict[bytes, Dict[bytes, int]] = {}
 
         self.yielded: List[bytes] = []
 
-        queue = deque()
+        queue = ElementQueue()
 
         commands = [
             YieldCommand(self.yielded),
             GetPreimageCommand(self.known_preimages, queue),
-            GetMerkleLeafIndexCommand(self.known_trees),
+            GetMerkleLeafIndexCommand(self.known_leaf_indexes),
             GetMerkleLeafProofCommand(self.known_trees, queue),
             GetMoreElementsCommand(queue),
         ]
 
-        self.commands = {cmd.code: cmd for cmd in commands}
+        # direct-indexed dispatch table of bound execute methods; command codes are
+        # single bytes, so indexing a 256-entry list replaces the dict probe and the
+        # per-call attribute lookups
+        self._dispatch: List[Optional[Callable[[bytes], bytes]]] = [None] * 256
+        for cmd in commands:
+            self._dispatch[cmd.code] = cmd.execute
 
     def execute(self, hw_response: bytes) -> bytes:
         """Interprets the client command requested by the hardware wallet, returning the appropriate
@@ -267,12 +343,13 @@ class ClientCommandInterpreter:
             )
 
         cmd_code = hw_response[0]
-        if cmd_code not in self.commands:
+        handler = self._dispatch[cmd_code]
+        if handler is None:
             raise RuntimeError(
                 "Unexpected command code: 0x{:02X}".format(cmd_code)
             )
 
-        return self.commands[cmd_code].execute(hw_response)
+        return handler(hw_response)
 
     def add_known_preimage(self, element: bytes) -> None:
         """Adds a preimage to the list of known preimages.
@@ -286,9 +363,10 @@ class ClientCommandInterpreter:
             An array of bytes whose preimage must be known to the client during an APDU execution.
         """
 
-        self.known_preimages[sha256(element)] = element
+        h = sha256(element)
+        self.known_preimages[int.from_bytes(h[:8], byteorder="big")] = (h, element)
 
-    def add_known_list(self, elements: List[bytes]) -> None:
+    def add_known_list(self, elements: List[bytes]) -> MerkleTree:
         """Adds a known Merkleized list.
 
         Builds the Merkle tree of `elements`, and adds it to the Merkle trees known to the client
@@ -304,31 +382,60 @@ class ClientCommandInterpreter:
         ----------
         elements : List[bytes]
             A list of `bytes` corresponding to the leafs of the Merkle tree.
+
+        Returns
+        -------
+        MerkleTree
+            The Merkle tree built on `elements`, as stored in `known_trees`.
         """
 
-        for el in elements:
-            self.add_known_preimage(b"\x00" + el)
+        # each leaf hash doubles as the preimage hash of the b'\0'-prefixed element;
+        # compute it once per element and reuse it for both purposes
+        leaf_hashes = [element_hash(el) for el in elements]
 
-        mt = MerkleTree(element_hash(el) for el in elements)
+        for el, leaf_hash in zip(elements, leaf_hashes):
+            key = int.from_bytes(leaf_hash[:8], byteorder="big")
+            self.known_preimages[key] = (leaf_hash, b"\x00" + el)
+
+        mt = MerkleTree(leaf_hashes)
 
         self.known_trees[mt.root] = mt
 
-    def add_known_mapping(self, mapping: Mapping[bytes, bytes]) -> None:
+        # map each leaf hash to its index for O(1) GET_MERKLE_LEAF_INDEX lookups;
+        # in case of duplicate leaves, keep the first occurrence
+        leaf_indexes = {}
+        for idx, leaf_hash in enumerate(leaf_hashes):
+            leaf_indexes.setdefault(leaf_hash, idx)
+        self.known_leaf_indexes[mt.root] = leaf_indexes
+
+        return mt
+
+    def add_known_mapping(self, mapping: Mapping[bytes, bytes]) -> bytes:
         """Adds the Merkle trees of keys, and the Merkle tree of values (ordered by key)
         of a mapping of bytes to bytes.
 
         Adds the Merkle tree of the list of keys, and the Merkle tree of the list of corresponding
-        values, with the same semantics as the `add_known_list` applied separately to the two lists. 
+        values, with the same semantics as the `add_known_list` applied separately to the two lists.
 
         Parameters
         ----------
         mapping : Mapping[bytes, bytes]
             A mapping whose keys and values are `bytes`.
+
+        Returns
+        -------
+        bytes
+            The serialized Merkleized map commitment of `mapping`, as defined in
+            `merkle.get_merkleized_map_commitment`; it is computed from the two Merkle
+            trees that are already built here, so callers that need the commitment avoid
+            re-hashing every key and value of the mapping.
         """
 
         items_sorted = list(sorted(mapping.items()))
 
         keys = [i[0] for i in items_sorted]
         values = [i[1] for i in items_sorted]
-        self.add_known_list(keys)
-        self.add_known_list(values)
+        keys_tree = self.add_known_list(keys)
+        values_tree = self.add_known_list(values)
+
+        return write_varint(len(mapping)) + keys_tree.root + values_tree.root
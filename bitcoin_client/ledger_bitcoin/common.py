@@ -119,19 +119,21 @@ def serialize_str(value: str) -> bytes:
     return len(value.encode()).to_bytes(1, byteorder="big") + value.encode()
 
 
-def ripemd160(x: bytes) -> bytes:
-    try:
-        h = hashlib.new("ripemd160")
-        h.update(x)
-        return h.digest()
-    except BaseException:
-        # ripemd160 is not always present in hashlib.
-        # Fallback to custom implementation if missing.
-        from . import ripemd
+try:
+    hashlib.new("ripemd160")
+
+    def ripemd160(x: bytes) -> bytes:
+        return hashlib.new("ripemd160", x).digest()
+except BaseException:
+    # ripemd160 is not always present in hashlib.
+    # Fallback to custom implementation if missing.
+    from . import ripemd
+
+    def ripemd160(x: bytes) -> bytes:
         return ripemd.ripemd160(x)
 
 def sha256(s: bytes) -> bytes:
-    return hashlib.new('sha256', s).digest()
+    return hashlib.sha256(s).digest()
 
 
 def hash160(s: bytes) -> bytes:
@@ -22,6 +22,7 @@ from binascii import unhexlify
 from collections import namedtuple
 from enum import Enum
 from typing import (
+    Dict,
     List,
     Optional,
     Tuple,
@@ -117,6 +118,7 @@ class PubkeyProvider(object):
         self.origin = origin
         self.pubkey = pubkey
         self.deriv_path = deriv_path
+        self._derived_pubkeys: Dict[int, bytes] = {}
 
         # Make ExtendedKey from pubkey if it isn't hex
         self.extkey = None
@@ -167,10 +169,20 @@ class PubkeyProvider(object):
         if self.extkey is not None:
             if self.deriv_path is not None:
                 path_str = self.deriv_path[1:]
-                if path_str[-1] == "*":
+                is_ranged = path_str[-1] == "*"
+                # BIP32 derivation is the expensive part (EC point arithmetic);
+                # derive each position only once. A path without a wildcard
+                # derives the same child key at every position, so all
+                # positions share a single cache slot.
+                cache_key = pos if is_ranged else -1
+                cached = self._derived_pubkeys.get(cache_key)
+                if cached is not None:
+                    return cached
+                if is_ranged:
                     path_str = path_str[-1] + str(pos)
                 path = parse_path(path_str)
                 child_key = self.extkey.derive_pub_path(path)
+                self._derived_pubkeys[cache_key] = child_key.pubkey
                 return child_key.pubkey
             else:
                 return self.extkey.pubkey
@@ -236,13 +236,14 @@ class MerkleTree:
         """Produce the Merkle proof of membership for the leaf with the given index where 0 <= index < len(self)."""
         node = self.leaves[index]
         proof = []
-        while node.parent is not None:
-            sibling = node.sibling()
-            assert sibling is not None
-
+        parent = node.parent
+        while parent is not None:
+            # inline sibling lookup; every internal node has exactly two children
+            sibling = parent.right if parent.left is node else parent.left
             proof.append(sibling.value)
 
-            node = node.parent
+            node = parent
+            parent = node.parent
 
         return proof
 